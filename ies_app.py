@@ -1,10 +1,13 @@
 import streamlit as st
-import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import graphviz
 import io
-from ies_simulation import IESModel
+import os
+import re
+import html
+import base64
+from dataclasses import dataclass
+
+# graphviz / matplotlib / pandas / IESModel (PyPSA) 均在使用处延迟导入，加快应用冷启动
 
 # 设置页面配置
 st.set_page_config(page_title="综合能源系统 (IES) 仿真平台", layout="wide")
@@ -18,30 +21,31 @@ st.markdown("""
 st.sidebar.header("🛠 组件库 (Device Library)")
 
 # 1. 设备选择
-st.sidebar.subheader("选择要包含的设备")
-selected_devices = []
-
-# 基础设备 (默认可选)
-if st.sidebar.checkbox("光伏 (PV)", value=True): selected_devices.append('pv')
-if st.sidebar.checkbox("外部电网 (Grid)", value=True): selected_devices.append('grid')
-
-st.sidebar.markdown("---")
-# 转换设备
-if st.sidebar.checkbox("电锅炉 (Electric Boiler)"): selected_devices.append('electric_boiler')
-
-st.sidebar.markdown("**热泵家族 (制热/制冷互斥)**")
-if st.sidebar.checkbox("空气源热泵 (ASHP)"): selected_devices.append('ashp')
-if st.sidebar.checkbox("浅层地源热泵 (GSHP-Shallow)"): selected_devices.append('gshp_shallow')
-if st.sidebar.checkbox("中深层地源热泵 (GSHP-Deep)"): selected_devices.append('gshp_deep')
+# (设备 ID, 显示名称)
+DEVICE_OPTIONS = [
+    # 基础设备 (默认可选)
+    ('pv', "光伏 (PV)"),
+    ('grid', "外部电网 (Grid)"),
+    # 转换设备
+    ('electric_boiler', "电锅炉 (Electric Boiler)"),
+    ('ashp', "空气源热泵 (ASHP)"),
+    ('gshp_shallow', "浅层地源热泵 (GSHP-Shallow)"),
+    ('gshp_deep', "中深层地源热泵 (GSHP-Deep)"),
+    ('electrolyzer', "电解槽 (Electrolyzer)"),
+    ('fuel_cell', "燃料电池 (Fuel Cell - 产电产热)"),
+    # 储能设备
+    ('battery', "蓄电池 (Battery)"),
+    ('h2_storage', "氢储能 (H2 Storage)"),
+]
 
-st.sidebar.markdown("---")
-if st.sidebar.checkbox("电解槽 (Electrolyzer)"): selected_devices.append('electrolyzer')
-if st.sidebar.checkbox("燃料电池 (Fuel Cell - 产电产热)"): selected_devices.append('fuel_cell')
-
-st.sidebar.markdown("---")
-# 储能设备
-if st.sidebar.checkbox("蓄电池 (Battery)"): selected_devices.append('battery')
-if st.sidebar.checkbox("氢储能 (H2 Storage)"): selected_devices.append('h2_storage')
+st.sidebar.subheader("选择要包含的设备")
+selected_devices = st.sidebar.multiselect(
+    "设备",
+    [k for k, _ in DEVICE_OPTIONS],
+    default=['pv', 'grid'],
+    format_func=dict(DEVICE_OPTIONS).get,
+)
+st.sidebar.caption("热泵家族 (ASHP / GSHP-S / GSHP-D) 制热/制冷互斥")
 
 st.sidebar.markdown("---")
 # 作者信息
@@ -57,253 +61,384 @@ st.sidebar.markdown("""
 # 2. 参数配置
 st.sidebar.header("⚙️ 参数设置")
 
+# 定义一个典型的分时电价
+TOU_PRICES = np.full(24, 0.6)  # 平
+TOU_PRICES[0:8] = 0.3          # 谷
+TOU_PRICES[10:15] = 1.0        # 峰
+TOU_PRICES[18:21] = 1.0        # 峰
+
 with st.sidebar.expander("能源价格 (分时电价)"):
     price_mode = st.radio("电价模式", ["固定电价", "分时电价 (TOU)"])
     if price_mode == "固定电价":
         grid_price_val = st.slider("网购电价 (元/kWh)", 0.2, 1.5, 0.6)
         grid_price = [grid_price_val] * 24
     else:
-        # 定义一个典型的分时电价
-        tou_prices = []
-        for h in range(24):
-            if 0 <= h < 8:
-                tou_prices.append(0.3) # 谷
-            elif 10 <= h < 15 or 18 <= h < 21:
-                tou_prices.append(1.0) # 峰
-            else:
-                tou_prices.append(0.6) # 平
-        
         st.info("当前分时电价: 谷(0-8h): 0.3, 平: 0.6, 峰(10-15h, 18-21h): 1.0")
-        grid_price = tou_prices
+        grid_price = TOU_PRICES.tolist()
+
+# 设备参数表：(IESInputs 字段, 类别, 参数名称, 默认值, 取值范围)
+DEVICE_PARAMS = [
+    ('pv_p_nom', "🔌 电力", "光伏 (PV) 装机容量 (kW)", 1000, None),
+    ('bat_p_nom', "🔌 电力", "蓄电池最大放电功率 (kW)", 100, None),
+    ('bat_hours', "🔌 电力", "蓄电池储存时长 (h)", 4, None),
+    ('boiler_p_nom', "♨️ 热力", "电锅炉装机容量 (kW)", 2000, None),
+    ('ashp_p_nom', "♨️ 热力", "ASHP 装机容量 (kW)", 500, None),
+    ('ashp_eff', "♨️ 热力", "ASHP 制热 COP", 3.0, None),
+    ('ashp_eer', "♨️ 热力", "ASHP 制冷 EER", 3.5, None),
+    ('gshp_shallow_p_nom', "♨️ 热力", "GSHP-S 装机容量 (kW)", 1000, None),
+    ('gshp_shallow_eff', "♨️ 热力", "GSHP-S 制热 COP", 4.0, None),
+    ('gshp_shallow_eer', "♨️ 热力", "GSHP-S 制冷 EER", 4.5, None),
+    ('gshp_deep_p_nom', "♨️ 热力", "GSHP-D 装机容量 (kW)", 500, None),
+    ('gshp_deep_eff', "♨️ 热力", "GSHP-D 制热 COP", 5.0, None),
+    ('gshp_deep_eer', "♨️ 热力", "GSHP-D 制冷 EER", 5.5, None),
+    ('ely_p_nom', "🧪 氢能", "电解槽装机容量 (kW)", 100, None),
+    ('ely_eff', "🧪 氢能", "电解槽效率", 0.75, (0.5, 0.9)),
+    ('fc_p_nom', "🧪 氢能", "燃料电池装机容量 (kW)", 100, None),
+    ('fc_eff_elec', "🧪 氢能", "燃料电池发电效率", 0.40, (0.3, 0.8)),
+    ('fc_eff_heat', "🧪 氢能", "燃料电池产热效率", 0.45, (0.2, 0.6)),
+    ('h2s_p_nom', "🧪 氢能", "氢储能最大放氢功率 (kW)", 200, None),
+    ('h2s_hours', "🧪 氢能", "氢储能储存时长 (h)", 20, None),
+]
 
 with st.sidebar.expander("设备详细参数 (装机容量 & 效率)"):
-    st.markdown("### 🔌 电力设备")
-    pv_cap = st.number_input("光伏 (PV) 装机容量 (kW)", value=1000)
-    bat_cap = st.number_input("蓄电池最大放电功率 (kW)", value=100)
-    bat_hours = st.number_input("蓄电池储存时长 (h)", value=4)
-    
-    st.markdown("### ♨️ 热力/转换设备")
-    eb_cap = st.number_input("电锅炉装机容量 (kW)", value=2000)
-    
-    st.markdown("**空气源热泵 (ASHP)**")
-    ashp_cap = st.number_input("ASHP 装机容量 (kW)", value=500)
-    ashp_cop = st.number_input("ASHP 制热 COP", value=3.0)
-    ashp_eer = st.number_input("ASHP 制冷 EER", value=3.5)
-    
-    st.markdown("**浅层地源热泵 (GSHP-S)**")
-    gshp_s_cap = st.number_input("GSHP-S 装机容量 (kW)", value=1000)
-    gshp_s_cop = st.number_input("GSHP-S 制热 COP", value=4.0)
-    gshp_s_eer = st.number_input("GSHP-S 制冷 EER", value=4.5)
-    
-    st.markdown("**中深层地源热泵 (GSHP-D)**")
-    gshp_d_cap = st.number_input("GSHP-D 装机容量 (kW)", value=500)
-    gshp_d_cop = st.number_input("GSHP-D 制热 COP", value=5.0)
-    gshp_d_eer = st.number_input("GSHP-D 制冷 EER", value=5.5)
-    
-    st.markdown("### 🧪 氢能设备")
-    ely_cap = st.number_input("电解槽装机容量 (kW)", value=100)
-    ely_eff = st.slider("电解槽效率", 0.5, 0.9, 0.75)
-    
-    fc_cap = st.number_input("燃料电池装机容量 (kW)", value=100)
-    fc_eff_e = st.slider("燃料电池发电效率", 0.3, 0.8, 0.40)
-    fc_eff_h = st.slider("燃料电池产热效率", 0.2, 0.6, 0.45)
-    
-    h2s_cap = st.number_input("氢储能最大放氢功率 (kW)", value=200)
-    h2s_hours = st.number_input("氢储能储存时长 (h)", value=20)
+    # 全部参数放在一个表格控件中，每次交互只产生一次控件状态更新
+    edited_params = st.data_editor(
+        {
+            "类别": [p[1] for p in DEVICE_PARAMS],
+            "参数": [p[2] for p in DEVICE_PARAMS],
+            "数值": [p[3] for p in DEVICE_PARAMS],
+        },
+        hide_index=True,
+        disabled=["类别", "参数"],
+        key="device_params",
+    )
+
+# 按行序取回参数值，效率类参数限制在原取值范围内
+device_params = {}
+for (field, _, _, default, bounds), value in zip(DEVICE_PARAMS, edited_params["数值"]):
+    value = default if value is None else value
+    if bounds is not None:
+        value = min(max(value, bounds[0]), bounds[1])
+    device_params[field] = value
+
+with st.sidebar.expander("求解器设置 (HiGHS)"):
+    fast_mode = st.checkbox("快速模式 (内点法 + 放宽容差)", value=True)
+
+# HiGHS 求解参数：快速模式使用内点法且不做 crossover，并放宽可行性/最优性容差
+HIGHS_OPTIONS = {"parallel": "on", "threads": os.cpu_count()}
+HIGHS_FAST_OPTIONS = {
+    "solver": "ipm",
+    "run_crossover": "off",
+    "primal_feasibility_tolerance": 1e-5,
+    "dual_feasibility_tolerance": 1e-5,
+    "ipm_optimality_tolerance": 1e-4,
+}
 
 # --- 数据准备 ---
+@dataclass(frozen=True)
+class IESInputs:
+    """
+    模型输入参数 (不可变、可哈希)，曲线类字段使用 tuple，可直接作为 st.cache_* 的缓存键
+    """
+    hours: int
+    # 负荷曲线
+    elec_load: tuple
+    heat_load: tuple
+    cool_load: tuple
+    h2_load: tuple
+    # PV 曲线 (归一化后再乘以容量)
+    pv_pu: tuple
+    # 设备参数
+    pv_p_nom: float
+    grid_cost: tuple
+    boiler_p_nom: float
+    ashp_p_nom: float
+    ashp_eff: float
+    ashp_eer: float
+    gshp_shallow_p_nom: float
+    gshp_shallow_eff: float
+    gshp_shallow_eer: float
+    gshp_deep_p_nom: float
+    gshp_deep_eff: float
+    gshp_deep_eer: float
+    ely_p_nom: float
+    ely_eff: float
+    fc_p_nom: float
+    fc_eff_elec: float
+    fc_eff_heat: float
+    bat_p_nom: float
+    bat_hours: float
+    h2s_p_nom: float
+    h2s_hours: float
+    bat_eff_store: float = 0.9
+    bat_eff_dispatch: float = 0.9
+
 hours = 24
-np.random.seed(42)
 
-input_data = {
-    'hours': hours,
+input_data = IESInputs(
+    hours=hours,
     # 负荷曲线
-    'elec_load': [43.6, 43.6, 43.6, 43.6, 43.6, 43.6, 55.3, 56.1, 55.7, 54.8, 54.5, 54.5, 54.5, 54.5, 54.5, 54.5, 54.5, 54.5, 44.5, 43.6, 43.6, 43.6, 43.6, 43.6],
-    'heat_load': [1600.2, 1632.0, 1669.3, 1714.7, 1771.1, 1818.9, 1858.1, 2626.1, 2724.2, 2605.0, 2419.0, 1991.3, 1904.3, 1560.7, 1996.4, 1455.8, 1429.8, 1666.8, 1755.0, 1626.3, 1715.2, 1655.7, 1496.5, 1520.4],
-    'cool_load': [2, 2, 2, 2, 2, 5, 10, 15, 20, 25, 30, 35, 38, 40, 38, 35, 30, 25, 20, 15, 10, 5, 2, 2],
-    'h2_load': [0.0] * 24,
+    elec_load=(43.6, 43.6, 43.6, 43.6, 43.6, 43.6, 55.3, 56.1, 55.7, 54.8, 54.5, 54.5, 54.5, 54.5, 54.5, 54.5, 54.5, 54.5, 44.5, 43.6, 43.6, 43.6, 43.6, 43.6),
+    heat_load=(1600.2, 1632.0, 1669.3, 1714.7, 1771.1, 1818.9, 1858.1, 2626.1, 2724.2, 2605.0, 2419.0, 1991.3, 1904.3, 1560.7, 1996.4, 1455.8, 1429.8, 1666.8, 1755.0, 1626.3, 1715.2, 1655.7, 1496.5, 1520.4),
+    cool_load=(2, 2, 2, 2, 2, 5, 10, 15, 20, 25, 30, 35, 38, 40, 38, 35, 30, 25, 20, 15, 10, 5, 2, 2),
+    h2_load=(0.0,) * 24,
     
     # PV 曲线 (归一化后再乘以容量)
-    'pv_pu': [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.2, 0.5, 1.0, 0.6, 0.25, 0.05, 0.01, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0],
+    pv_pu=(0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.2, 0.5, 1.0, 0.6, 0.25, 0.05, 0.01, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0),
     
     # 设备参数 (从 UI 获取)
-    'pv_p_nom': pv_cap,
-    'grid_cost': grid_price,
-    
-    'boiler_p_nom': eb_cap,
-    
-    'ashp_p_nom': ashp_cap,
-    'ashp_eff': ashp_cop,
-    'ashp_eer': ashp_eer,
-    
-    'gshp_shallow_p_nom': gshp_s_cap,
-    'gshp_shallow_eff': gshp_s_cop,
-    'gshp_shallow_eer': gshp_s_eer,
-    
-    'gshp_deep_p_nom': gshp_d_cap,
-    'gshp_deep_eff': gshp_d_cop,
-    'gshp_deep_eer': gshp_d_eer,
-    
-    'ely_p_nom': ely_cap,
-    'ely_eff': ely_eff,
-    
-    'fc_p_nom': fc_cap,
-    'fc_eff_elec': fc_eff_e,
-    'fc_eff_heat': fc_eff_h,
+    grid_cost=tuple(grid_price),
+    **device_params,
     
-    'bat_p_nom': bat_cap,
-    'bat_hours': bat_hours,
-    
-    'h2s_p_nom': h2s_cap,
-    'h2s_hours': h2s_hours,
-    
-    'bat_eff_store': 0.9,
-    'bat_eff_dispatch': 0.9,
-}
+    bat_eff_store=0.9,
+    bat_eff_dispatch=0.9,
+)
 
 # --- 主界面布局 ---
 st.subheader("🏗 系统拓扑图 (Topology)")
 
-import os
 # 使用相对路径，避免绝对路径中的特殊字符（如 #）导致 Graphviz 解析失败
 icon_dir = "icon"
 
-dot = graphviz.Digraph(comment='IES Topology')
-# 改为 TB (Top to Bottom) 布局，配合横向母线实现横向分布
-dot.attr(rankdir='TB', size='12,6!', ratio='fill')
-dot.attr(nodesep='0.5', ranksep='0.5')
-# 设置全局字体为 Times-Roman (即 Times New Roman) 且颜色为黑色
-dot.attr(fontname='Times-Roman', fontcolor='black')
-dot.attr('node', fontname='Times-Roman', fontcolor='black')
-dot.attr('edge', fontname='Times-Roman', fontcolor='black')
-
-# 计算各母线连接的组件数量以确定宽度
-elec_conn = 1  # 基础负载
-if 'pv' in selected_devices: elec_conn += 1
-if 'grid' in selected_devices: elec_conn += 1
-if 'electric_boiler' in selected_devices: elec_conn += 1
-if 'ashp' in selected_devices: elec_conn += 1
-if 'gshp_shallow' in selected_devices: elec_conn += 1
-if 'gshp_deep' in selected_devices: elec_conn += 1
-if 'electrolyzer' in selected_devices: elec_conn += 1
-if 'fuel_cell' in selected_devices: elec_conn += 1
-if 'battery' in selected_devices: elec_conn += 1
-
-heat_conn = 1
-if 'electric_boiler' in selected_devices: heat_conn += 1
-if 'ashp' in selected_devices: heat_conn += 1
-if 'gshp_shallow' in selected_devices: heat_conn += 1
-if 'gshp_deep' in selected_devices: heat_conn += 1
-if 'fuel_cell' in selected_devices: heat_conn += 1
-
-cool_conn = 1
-if 'ashp' in selected_devices: cool_conn += 1
-if 'gshp_shallow' in selected_devices: cool_conn += 1
-if 'gshp_deep' in selected_devices: cool_conn += 1
-
-h2_conn = 1
-if 'electrolyzer' in selected_devices: h2_conn += 1
-if 'fuel_cell' in selected_devices: h2_conn += 1
-if 'h2_storage' in selected_devices: h2_conn += 1
-
-# 动态宽度设置 (宽度 = 连接数 * 系数)
-w_elec = str(max(2.5, elec_conn * 1.0))
-w_heat = str(max(2.5, heat_conn * 1.0))
-w_cool = str(max(2.5, cool_conn * 1.0))
-w_h2 = str(max(2.5, h2_conn * 1.0))
-
-# 定义母线节点 (横向线条形状 - Horizontal Busbar)
-bus_style = {"shape": "box", "height": "0.04", "style": "filled", "fixedsize": "true", "penwidth": "0", "labelloc": "t", "fontsize": "12"}
-dot.node('Bus_Elec', 'Elec Bus', width=w_elec, fillcolor='blue', fontcolor='black', **bus_style)
-dot.node('Bus_Heat', 'Heat Bus', width=w_heat, fillcolor='red', fontcolor='black', **bus_style)
-dot.node('Bus_Cool', 'Cool Bus', width=w_cool, fillcolor='cyan', fontcolor='black', **bus_style)
-dot.node('Bus_H2', 'H2 Bus', width=w_h2, fillcolor='green', fontcolor='black', **bus_style)
-
-# 定义负载节点
-dot.node('Load_Elec', 'Elec Load', shape='none', image=os.path.join(icon_dir, "eleload.png"), labelloc='b')
-dot.node('Load_Heat', 'Heat Load', shape='none', image=os.path.join(icon_dir, "heating.png"), labelloc='b')
-dot.node('Load_Cool', 'Cool Load', shape='none', image=os.path.join(icon_dir, "cooling.png"), labelloc='b')
-dot.node('Load_H2', 'H2 Load', shape='ellipse')
-
-dot.edge('Bus_Elec', 'Load_Elec', color='blue')
-dot.edge('Bus_Heat', 'Load_Heat', color='red')
-dot.edge('Bus_Cool', 'Load_Cool', color='cyan')
-dot.edge('Bus_H2', 'Load_H2', color='green')
-
-# 根据选择添加组件和连线
-if 'pv' in selected_devices:
-    dot.node('PV', 'PV', shape='none', image=os.path.join(icon_dir, "pv.png"), labelloc='b')
-    dot.edge('PV', 'Bus_Elec', color='blue')
-
-if 'grid' in selected_devices:
-    dot.node('Grid', 'Grid', shape='none', image=os.path.join(icon_dir, "grid.png"), labelloc='b')
-    dot.edge('Grid', 'Bus_Elec', color='blue')
+# 各母线所连接的设备
+ELEC_BUS_DEVICES = frozenset({'pv', 'grid', 'electric_boiler', 'ashp', 'gshp_shallow', 'gshp_deep', 'electrolyzer', 'fuel_cell', 'battery'})
+HEAT_BUS_DEVICES = frozenset({'electric_boiler', 'ashp', 'gshp_shallow', 'gshp_deep', 'fuel_cell'})
+COOL_BUS_DEVICES = frozenset({'ashp', 'gshp_shallow', 'gshp_deep'})
+H2_BUS_DEVICES = frozenset({'electrolyzer', 'fuel_cell', 'h2_storage'})
+
+@st.cache_resource(show_spinner=False)
+def _base_dot():
+    """
+    构建与设备选择无关的基础拓扑 (全局样式 + 4 条母线 + 4 个负载)
+    Streamlit 每次 rerun 都会重新执行脚本，模块级缓存会随之失效，因此用 st.cache_resource 跨 rerun 复用
+    :return: graphviz.Digraph 对象 (各会话共享)，使用前需 copy()
+    """
+    import graphviz
+
+    dot = graphviz.Digraph(comment='IES Topology')
+    # 改为 TB (Top to Bottom) 布局，配合横向母线实现横向分布
+    dot.attr(rankdir='TB', size='12,6!', ratio='fill')
+    dot.attr(nodesep='0.5', ranksep='0.5')
+    # 设置全局字体为 Times-Roman (即 Times New Roman) 且颜色为黑色
+    dot.attr(fontname='Times-Roman', fontcolor='black')
+    dot.attr('node', fontname='Times-Roman', fontcolor='black')
+    dot.attr('edge', fontname='Times-Roman', fontcolor='black')
+
+    # 定义母线节点 (横向线条形状 - Horizontal Busbar)，宽度在 build_topology 中按连接数设置
+    bus_style = {"shape": "box", "height": "0.04", "style": "filled", "fixedsize": "true", "penwidth": "0", "labelloc": "t", "fontsize": "12"}
+    dot.node('Bus_Elec', 'Elec Bus', fillcolor='blue', fontcolor='black', **bus_style)
+    dot.node('Bus_Heat', 'Heat Bus', fillcolor='red', fontcolor='black', **bus_style)
+    dot.node('Bus_Cool', 'Cool Bus', fillcolor='cyan', fontcolor='black', **bus_style)
+    dot.node('Bus_H2', 'H2 Bus', fillcolor='green', fontcolor='black', **bus_style)
+
+    # 定义负载节点
+    dot.node('Load_Elec', 'Elec Load', shape='none', image=os.path.join(icon_dir, "eleload.png"), labelloc='b')
+    dot.node('Load_Heat', 'Heat Load', shape='none', image=os.path.join(icon_dir, "heating.png"), labelloc='b')
+    dot.node('Load_Cool', 'Cool Load', shape='none', image=os.path.join(icon_dir, "cooling.png"), labelloc='b')
+    dot.node('Load_H2', 'H2 Load', shape='ellipse')
+
+    dot.edge('Bus_Elec', 'Load_Elec', color='blue')
+    dot.edge('Bus_Heat', 'Load_Heat', color='red')
+    dot.edge('Bus_Cool', 'Load_Cool', color='cyan')
+    dot.edge('Bus_H2', 'Load_H2', color='green')
+
+    return dot
+
+def build_topology(devices):
+    """
+    根据所选设备构建拓扑图
+    :param devices: 已选设备的元组
+    :return: graphviz.Digraph 对象
+    """
+    dot = _base_dot().copy()
+
+    # 计算各母线连接的组件数量以确定宽度 (1 为基础负载)
+    sel = frozenset(devices)
+    elec_conn = 1 + len(sel & ELEC_BUS_DEVICES)
+    heat_conn = 1 + len(sel & HEAT_BUS_DEVICES)
+    cool_conn = 1 + len(sel & COOL_BUS_DEVICES)
+    h2_conn = 1 + len(sel & H2_BUS_DEVICES)
+
+    # 动态宽度设置 (宽度 = 连接数 * 系数)
+    dot.node('Bus_Elec', width=str(max(2.5, elec_conn * 1.0)))
+    dot.node('Bus_Heat', width=str(max(2.5, heat_conn * 1.0)))
+    dot.node('Bus_Cool', width=str(max(2.5, cool_conn * 1.0)))
+    dot.node('Bus_H2', width=str(max(2.5, h2_conn * 1.0)))
+
+    # 根据选择添加组件和连线
+    if 'pv' in devices:
+        dot.node('PV', 'PV', shape='none', image=os.path.join(icon_dir, "pv.png"), labelloc='b')
+        dot.edge('PV', 'Bus_Elec', color='blue')
+
+    if 'grid' in devices:
+        dot.node('Grid', 'Grid', shape='none', image=os.path.join(icon_dir, "grid.png"), labelloc='b')
+        dot.edge('Grid', 'Bus_Elec', color='blue')
     
-if 'electric_boiler' in selected_devices:
-    dot.node('EB', 'EB', shape='none', image=os.path.join(icon_dir, "EB.png"), labelloc='b')
-    dot.edge('Bus_Elec', 'EB', color='blue')
-    dot.edge('EB', 'Bus_Heat', color='red')
+    if 'electric_boiler' in devices:
+        dot.node('EB', 'EB', shape='none', image=os.path.join(icon_dir, "EB.png"), labelloc='b')
+        dot.edge('Bus_Elec', 'EB', color='blue')
+        dot.edge('EB', 'Bus_Heat', color='red')
     
-hp_map = {'ashp': ('ASHP', 'ashp.png'), 'gshp_shallow': ('GSHP-S', 'heatpump2.png'), 'gshp_deep': ('GSHP-D', 'heatpump3.png')}
-for hp_id, (hp_label, hp_icon) in hp_map.items():
-    if hp_id in selected_devices:
-        dot.node(hp_id, hp_label, shape='none', image=os.path.join(icon_dir, hp_icon), labelloc='b')
-        dot.edge('Bus_Elec', hp_id, color='blue')
-        dot.edge(hp_id, 'Bus_Heat', color='red')
-        dot.edge(hp_id, 'Bus_Cool', color='cyan')
+    hp_map = {'ashp': ('ASHP', 'ashp.png'), 'gshp_shallow': ('GSHP-S', 'heatpump2.png'), 'gshp_deep': ('GSHP-D', 'heatpump3.png')}
+    for hp_id, (hp_label, hp_icon) in hp_map.items():
+        if hp_id in devices:
+            dot.node(hp_id, hp_label, shape='none', image=os.path.join(icon_dir, hp_icon), labelloc='b')
+            dot.edge('Bus_Elec', hp_id, color='blue')
+            dot.edge(hp_id, 'Bus_Heat', color='red')
+            dot.edge(hp_id, 'Bus_Cool', color='cyan')
         
-if 'electrolyzer' in selected_devices:
-    dot.node('Ely', 'Ely', shape='none', image=os.path.join(icon_dir, "electrolyzer.png"), labelloc='b')
-    dot.edge('Bus_Elec', 'Ely', color='blue')
-    dot.edge('Ely', 'Bus_H2', color='green')
+    if 'electrolyzer' in devices:
+        dot.node('Ely', 'Ely', shape='none', image=os.path.join(icon_dir, "electrolyzer.png"), labelloc='b')
+        dot.edge('Bus_Elec', 'Ely', color='blue')
+        dot.edge('Ely', 'Bus_H2', color='green')
     
-if 'fuel_cell' in selected_devices:
-    dot.node('FC', 'FC', shape='none', image=os.path.join(icon_dir, "fuelcell.png"), labelloc='b')
-    dot.edge('Bus_H2', 'FC', color='green')
-    dot.edge('FC', 'Bus_Elec', color='blue')
-    dot.edge('FC', 'Bus_Heat', color='red')
+    if 'fuel_cell' in devices:
+        dot.node('FC', 'FC', shape='none', image=os.path.join(icon_dir, "fuelcell.png"), labelloc='b')
+        dot.edge('Bus_H2', 'FC', color='green')
+        dot.edge('FC', 'Bus_Elec', color='blue')
+        dot.edge('FC', 'Bus_Heat', color='red')
     
-if 'battery' in selected_devices:
-    dot.node('Bat', 'Battery', shape='none', image=os.path.join(icon_dir, "battery.png"), labelloc='b')
-    dot.edge('Bus_Elec', 'Bat', dir='both', color='blue')
+    if 'battery' in devices:
+        dot.node('Bat', 'Battery', shape='none', image=os.path.join(icon_dir, "battery.png"), labelloc='b')
+        dot.edge('Bus_Elec', 'Bat', dir='both', color='blue')
     
-if 'h2_storage' in selected_devices:
-    dot.node('H2S', 'H2 Storage', shape='none', image=os.path.join(icon_dir, "hydrogen storage.png"), labelloc='b')
-    dot.edge('Bus_H2', 'H2S', dir='both', color='green')
-
+    if 'h2_storage' in devices:
+        dot.node('H2S', 'H2 Storage', shape='none', image=os.path.join(icon_dir, "hydrogen storage.png"), labelloc='b')
+        dot.edge('Bus_H2', 'H2S', dir='both', color='green')
+
+    return dot
+
+@st.cache_data(show_spinner=False)
+def _icon_data_uri(path):
+    """
+    读取本地图标并转为 base64 data URI，按路径跨 rerun 缓存
+    """
+    with open(path, 'rb') as f:
+        return "data:image/png;base64," + base64.b64encode(f.read()).decode('ascii')
+
+@st.cache_data(show_spinner=False)
+def render_topology_svg(devices):
+    """
+    渲染拓扑图 SVG，按设备元组缓存，拓扑不变时直接复用结果
+    SVG 中的图标路径替换为 data URI，浏览器端无需访问 icon/ 目录
+    :param devices: 排序后的已选设备元组
+    :return: SVG 文本
+    """
+    svg = build_topology(devices).pipe(format='svg').decode('utf-8')
+
+    def inline_icon(m):
+        path = html.unescape(m.group(2))
+        if not os.path.isfile(path):
+            return m.group(0)
+        return f'{m.group(1)}="{_icon_data_uri(path)}"'
+
+    return re.sub(r'(xlink:href|href)="([^"]+\.png)"', inline_icon, svg)
+
+topo_key = tuple(sorted(selected_devices))
 try:
-    png_data = dot.pipe(format='png')
-    st.image(png_data, use_container_width=True)
+    svg_data = render_topology_svg(topo_key)
+    st.image(svg_data, use_container_width=True)
 except Exception:
-    st.graphviz_chart(dot)
+    st.graphviz_chart(build_topology(topo_key))
 
-st.info("💡 提示：在左侧勾选设备，拓扑图将实时更新。")
+st.info("💡 提示：在左侧选择设备，拓扑图将实时更新。")
 
 st.markdown("---")
 st.subheader("📊 数据预览 (负荷 & 电价)")
-plt.rcParams['font.family'] = 'Times New Roman'
-plt.rcParams['text.color'] = 'black'
-fig_load, ax_load = plt.subplots(figsize=(12, 5))
-ax_load.plot(input_data['elec_load'], label='Elec Load [kW]', color='blue', linewidth=2)
-ax_load.plot(input_data['heat_load'], label='Heat Load [kW]', color='red', linestyle='--')
-ax_load.plot(input_data['cool_load'], label='Cool Load [kW]', color='green', linestyle=':')
-ax_load.set_ylabel("Power [kW]")
-ax_load.set_xlabel("Hour")
-ax_price = ax_load.twinx()
-ax_price.step(range(24), input_data['grid_cost'], where='post', label='Grid Price [元/kWh]', color='orange', alpha=0.7)
-ax_price.set_ylabel("Price [元/kWh]")
-lines, labels = ax_load.get_legend_handles_labels()
-lines2, labels2 = ax_price.get_legend_handles_labels()
-ax_load.legend(lines + lines2, labels + labels2, loc='upper left')
-plt.title("Input Load & Price Profiles")
-st.pyplot(fig_load)
+
+@st.cache_data(show_spinner=False)
+def render_load_chart(elec, heat, cool, price):
+    """
+    绘制负荷与电价曲线，按输入曲线缓存
+    :return: PNG 字节数据
+    """
+    # 只用 savefig 输出 PNG，不切换全局后端 (切换会关闭同一进程中其他会话打开的图)
+    import matplotlib.pyplot as plt
+
+    plt.rcParams['font.family'] = 'Times New Roman'
+    plt.rcParams['text.color'] = 'black'
+    fig_load, ax_load = plt.subplots(figsize=(12, 5))
+    ax_load.plot(elec, label='Elec Load [kW]', color='blue', linewidth=2)
+    ax_load.plot(heat, label='Heat Load [kW]', color='red', linestyle='--')
+    ax_load.plot(cool, label='Cool Load [kW]', color='green', linestyle=':')
+    ax_load.set_ylabel("Power [kW]")
+    ax_load.set_xlabel("Hour")
+    ax_price = ax_load.twinx()
+    ax_price.step(range(len(price)), price, where='post', label='Grid Price [元/kWh]', color='orange', alpha=0.7)
+    ax_price.set_ylabel("Price [元/kWh]")
+    lines, labels = ax_load.get_legend_handles_labels()
+    lines2, labels2 = ax_price.get_legend_handles_labels()
+    ax_load.legend(lines + lines2, labels + labels2, loc='upper left')
+    ax_load.set_title("Input Load & Price Profiles")
+    buf = io.BytesIO()
+    fig_load.savefig(buf, format='png', dpi=96)
+    plt.close(fig_load)
+    return buf.getvalue()
+
+load_png = render_load_chart(input_data.elec_load, input_data.heat_load, input_data.cool_load, input_data.grid_cost)
+st.image(load_png, use_container_width=True)
+
+# 每个缓存项持有完整的 PyPSA 网络及 linopy 模型，且为所有会话共享，需限制条目数
+SOLVE_CACHE_ENTRIES = 16
+
+@st.cache_resource(show_spinner=False, max_entries=SOLVE_CACHE_ENTRIES)
+def solve_ies(inputs, devices, fast_mode):
+    """
+    构建并求解模型，按输入参数与设备组合缓存 (最多 SOLVE_CACHE_ENTRIES 组)，输入不变时不重复求解
+    :param inputs: IESInputs 输入参数
+    :param devices: 排序后的已选设备元组
+    :param fast_mode: 是否使用 HiGHS 快速模式参数
+    :return: (model, 是否成功, 全部结果字典)
+    """
+    from ies_simulation import IESModel
+
+    highs_opts = dict(HIGHS_OPTIONS, **HIGHS_FAST_OPTIONS) if fast_mode else dict(HIGHS_OPTIONS)
+    model = IESModel(inputs)
+    model.build_model(components=list(devices))
+    # 非快速模式使用求解器默认容差 (严格求解)
+    ok = model.solve(solver_name="highs", solver_options=highs_opts, tolerances=None if fast_mode else {})
+    all_res = model.get_all_results() if ok else {}
+    return model, ok, all_res
+
+def dump_xlsx(all_res):
+    """
+    按行流式写出 Excel (xlsxwriter constant_memory 模式)，首列为时间索引，空表跳过
+    :param all_res: {sheet 名: DataFrame}
+    :return: xlsx 字节数据
+    """
+    import xlsxwriter
+
+    output = io.BytesIO()
+    wb = xlsxwriter.Workbook(output, {'constant_memory': True, 'strings_to_numbers': False})
+    for sheet_name, df in all_res.items():
+        if df.empty:
+            continue
+        ws = wb.add_worksheet(sheet_name)
+        ws.write_row(0, 0, [df.index.name or ""] + [str(c) for c in df.columns])
+        # NaN 写为空单元格
+        body = df.astype(object).where(df.notna(), None)
+        for r, row in enumerate(body.itertuples(index=True, name=None), start=1):
+            ws.write_row(r, 0, row)
+    wb.close()
+    return output.getvalue()
+
+@st.cache_data(show_spinner=False)
+def export_excel(key, _all_res):
+    """
+    将全部结果写入内存中的 Excel 文件，按求解键缓存，重复下载不再重新序列化
+    :param key: 求解键 (IESInputs, 设备元组, 快速模式)，与 solve_ies 的参数一致
+    :return: xlsx 字节数据
+    """
+    return dump_xlsx(_all_res)
 
 if st.button("🚀 开始仿真", type="primary"):
+    import pandas as pd
+
     with st.spinner("正在优化求解中..."):
-        model = IESModel(input_data)
-        model.build_model(components=selected_devices)
+        solve_key = (input_data, tuple(sorted(selected_devices)), fast_mode)
+        model, ok, all_res = solve_ies(*solve_key)
         
-        if model.solve():
+        if ok:
             st.success("仿真成功！")
             
             # --- 1. 全天工况统计输出 ---
@@ -312,54 +447,42 @@ if st.button("🚀 开始仿真", type="primary"):
             try:
                 # 提取各设备状态
                 snapshots = model.n.snapshots
+                p0 = model.n.links_t.p0
                 df_status = pd.DataFrame(index=snapshots)
                 
                 # 处理发电机 (PV, Grid)
                 for gen in model.n.generators.index:
                     if gen in model.n.generators_t.p.columns:
-                        df_status[f"{gen}"] = model.n.generators_t.p[gen].apply(lambda x: "运行" if x > 0.1 else "停机")
+                        df_status[f"{gen}"] = np.where(model.n.generators_t.p[gen].values > 0.1, "运行", "停机")
                 
                 # 处理转换链路 (EB, HP, Ely, FC)
-                # 分类汇总：制热、制冷、产氢、产电
-                status_list = []
-                for t in snapshots:
-                    active_heat = []
-                    active_cool = []
-                    active_h2 = []
-                    
-                    # 检查制热设备
-                    for link in ['electric_boiler', 'ashp_heating', 'gshp_shallow_heating', 'gshp_deep_heating', 'fuel_cell']:
-                        if link in model.n.links_t.p0.columns and model.n.links_t.p0.at[t, link] > 0.1:
-                            name = link.split('_')[0].upper()
-                            active_heat.append(name)
-                    
-                    # 检查制冷设备
-                    for link in ['ashp_cooling', 'gshp_shallow_cooling', 'gshp_deep_cooling']:
-                        if link in model.n.links_t.p0.columns and model.n.links_t.p0.at[t, link] > 0.1:
-                            name = link.split('_')[0].upper()
-                            active_cool.append(name)
-                            
-                    # 检查产氢
-                    if 'electrolyzer' in model.n.links_t.p0.columns and model.n.links_t.p0.at[t, 'electrolyzer'] > 0.1:
-                        active_h2.append("ELY")
-                        
-                    status_list.append({
-                        "时刻": f"{t:02d}:00",
-                        "供热设备": ", ".join(active_heat) if active_heat else "无",
-                        "供冷设备": ", ".join(active_cool) if active_cool else "无",
-                        "产氢状态": "运行" if active_h2 else "停止"
-                    })
+                # 分类汇总：制热、制冷、产氢、产电 (按整列布尔矩阵一次性判断全部时刻)
+                def get_active_names(links):
+                    cols = [link for link in links if link in p0.columns]
+                    if not cols:
+                        return np.full(len(snapshots), "无", dtype=object)
+                    names = np.array([link.split('_')[0].upper() + ", " for link in cols], dtype=object)
+                    active = p0[cols] > 0.1
+                    return active.dot(names).str.rstrip(", ").replace("", "无").to_numpy(dtype=object)
+                
+                time_col = np.array([f"{t:02d}:00" for t in snapshots], dtype=object)
+                # 检查制热设备
+                heat_col = get_active_names(['electric_boiler', 'ashp_heating', 'gshp_shallow_heating', 'gshp_deep_heating', 'fuel_cell'])
+                # 检查制冷设备
+                cool_col = get_active_names(['ashp_cooling', 'gshp_shallow_cooling', 'gshp_deep_cooling'])
+                # 检查产氢
+                if 'electrolyzer' in p0.columns:
+                    h2_col = np.where(p0['electrolyzer'].values > 0.1, "运行", "停止").astype(object)
+                else:
+                    h2_col = np.full(len(snapshots), "停止", dtype=object)
                 
-                df_links = pd.DataFrame(status_list)
+                df_links = pd.DataFrame({"时刻": time_col, "供热设备": heat_col, "供冷设备": cool_col, "产氢状态": h2_col})
                 
                 # 处理储能状态 (Battery, H2 Storage)
                 for storage in model.n.storage_units.index:
                     if storage in model.n.storage_units_t.p.columns:
-                        def get_storage_mode(p):
-                            if p > 0.1: return "放能"
-                            elif p < -0.1: return "储能"
-                            else: return "闲置"
-                        df_links[f"{storage}状态"] = model.n.storage_units_t.p[storage].apply(get_storage_mode).values
+                        p = model.n.storage_units_t.p[storage].values
+                        df_links[f"{storage}状态"] = np.select([p > 0.1, p < -0.1], ["放能", "储能"], default="闲置")
 
                 st.dataframe(df_links, use_container_width=True)
                 
@@ -380,7 +503,7 @@ if st.button("🚀 开始仿真", type="primary"):
                     if '产氢状态' in df_links.columns:
                         h2_hours = (df_links['产氢状态'] == "运行").sum()
                         st.write(f"- 🧪 电解槽：全天运行 {h2_hours} 小时")
-                    fc_hours = df_links['供热设备'].str.contains("FUEL").sum()
+                    fc_hours = int((p0['fuel_cell'].values > 0.1).sum()) if 'fuel_cell' in p0.columns else 0
                     st.write(f"- ⚡ 燃料电池：全天运行 {fc_hours} 小时")
 
             except Exception as e:
@@ -391,17 +514,7 @@ if st.button("🚀 开始仿真", type="primary"):
             st.subheader("📥 下载运行结果 (Export Results)")
             
             try:
-                # 获取所有结果
-                all_res = model.get_all_results()
-                
-                # 创建内存中的 Excel 文件
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    for sheet_name, df in all_res.items():
-                        if not df.empty:
-                            df.to_excel(writer, sheet_name=sheet_name)
-                
-                excel_data = output.getvalue()
+                excel_data = export_excel(solve_key, all_res)
                 
                 st.download_button(
                     label="📂 点击下载全天运行数据 (Excel)",
@@ -421,9 +534,10 @@ if st.button("🚀 开始仿真", type="primary"):
                 st.metric("总运行成本", f"{total_cost:.2f} 元")
                 
                 cols = st.columns(3)
+                maxes = model.n.links_t.p0.max(axis=0)
                 for i, link in enumerate(model.n.links.index):
-                    if not model.n.links_t.p0.empty and link in model.n.links_t.p0.columns:
-                        max_p = model.n.links_t.p0[link].max()
+                    max_p = maxes.get(link)
+                    if max_p is not None and not pd.isna(max_p):
                         cols[i % 3].write(f"**{link}** 最大功率: {max_p:.2f} kW")
             except Exception as e:
                 st.error(f"无法计算指标: {e}")
@@ -1,43 +1,201 @@
+import os
+import json
 import pypsa
+import hashlib
+import tempfile
+import functools
 import pandas as pd
 import numpy as np
+import xarray as xr
 import matplotlib.pyplot as plt
+from dataclasses import asdict, is_dataclass
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba 为可选依赖，缺失时 KPI 统计退回 NumPy 实现
+    njit = None
+
+# 支持 MIP 初始解文件的求解器及其文件格式
+MIP_START_SUFFIX = {'highs': '.sol', 'gurobi': '.mst'}
+
+# 探索性计算的默认容差：mip_gap 为相对 MIP 间隙，feasibility 为可行性容差
+DEFAULT_TOLERANCES = {'mip_gap': 1e-2, 'feasibility': 1e-5}
+
+# 通用容差名称到各求解器参数名的映射
+TOLERANCE_KEYS = {
+    'gurobi': {'mip_gap': 'MIPGap', 'feasibility': 'FeasibilityTol'},
+    'copt': {'mip_gap': 'RelGap', 'feasibility': 'FeasTol'},
+    'glpk': {'mip_gap': 'mipgap'},
+    'highs': {'mip_gap': 'mip_rel_gap', 'feasibility': 'mip_feasibility_tolerance'},
+}
+
+# 逐时曲线参数到网络时变属性的映射：参数名 -> (组件表, 组件名, 属性)
+TIMESERIES_ATTRS = {
+    'grid_cost': ('generators', 'grid', 'marginal_cost'),
+    'pv_pu': ('generators', 'pv', 'p_max_pu'),
+    'elec_load': ('loads', 'elec_load', 'p_set'),
+    'heat_load': ('loads', 'heat_load', 'p_set'),
+    'cool_load': ('loads', 'cool_load', 'p_set'),
+    'h2_load': ('loads', 'h2_load', 'p_set'),
+}
+
+# 标量设备参数到网络静态属性的映射：参数名 -> [(组件表, 组件名, 属性)]
+STATIC_ATTRS = {
+    'pv_p_nom': [('generators', 'pv', 'p_nom')],
+    'pv_cost': [('generators', 'pv', 'marginal_cost')],
+    'boiler_p_nom': [('links', 'electric_boiler', 'p_nom')],
+    'boiler_eff': [('links', 'electric_boiler', 'efficiency')],
+    'ashp_p_nom': [('links', 'ashp_heating', 'p_nom'), ('links', 'ashp_cooling', 'p_nom')],
+    'ashp_eff': [('links', 'ashp_heating', 'efficiency')],
+    'ashp_eer': [('links', 'ashp_cooling', 'efficiency')],
+    'gshp_shallow_p_nom': [('links', 'gshp_shallow_heating', 'p_nom'), ('links', 'gshp_shallow_cooling', 'p_nom')],
+    'gshp_shallow_eff': [('links', 'gshp_shallow_heating', 'efficiency')],
+    'gshp_shallow_eer': [('links', 'gshp_shallow_cooling', 'efficiency')],
+    'gshp_deep_p_nom': [('links', 'gshp_deep_heating', 'p_nom'), ('links', 'gshp_deep_cooling', 'p_nom')],
+    'gshp_deep_eff': [('links', 'gshp_deep_heating', 'efficiency')],
+    'gshp_deep_eer': [('links', 'gshp_deep_cooling', 'efficiency')],
+    'ely_p_nom': [('links', 'electrolyzer', 'p_nom')],
+    'ely_eff': [('links', 'electrolyzer', 'efficiency')],
+    'fc_p_nom': [('links', 'fuel_cell', 'p_nom')],
+    'fc_eff_elec': [('links', 'fuel_cell', 'efficiency')],
+    'fc_eff_heat': [('links', 'fuel_cell', 'efficiency2')],
+    'bat_p_nom': [('storage_units', 'battery', 'p_nom')],
+    'bat_hours': [('storage_units', 'battery', 'max_hours')],
+    'bat_eff_store': [('storage_units', 'battery', 'efficiency_store')],
+    'bat_eff_dispatch': [('storage_units', 'battery', 'efficiency_dispatch')],
+    'h2s_p_nom': [('storage_units', 'h2_storage', 'p_nom')],
+    'h2s_hours': [('storage_units', 'h2_storage', 'max_hours')],
+}
+
+# 滚动求解时需要拼接的结果属性：组件表 -> 时变属性
+ROLLING_RESULT_ATTRS = {
+    'generators': ['p'],
+    'loads': ['p'],
+    'links': ['p0', 'p1', 'p2'],
+    'storage_units': ['p', 'p_store', 'p_dispatch', 'state_of_charge'],
+    'buses': ['marginal_price'],
+}
+
+# 冷负荷峰值低于该值 (kW) 时视为可忽略，见 build_model(skip_trivial_cooling=True)
+TRIVIAL_COOL_LOAD = 5
+
+# 多端口 Link 的附加端口属性不在 PyPSA 默认属性表中，批量添加时用以下取值补齐
+MULTIPORT_DEFAULTS = {'bus2': "", 'efficiency2': 1.0}
+
+def _kpis_numpy(p):
+    """
+    按列计算出力曲线的峰值、均值和爬坡量 (相邻时段出力差的绝对值之和)
+    :param p: (T, N) 的出力矩阵
+    :return: (peak, mean, ramp) 三个长度为 N 的数组
+    """
+    return p.max(axis=0), p.mean(axis=0), np.abs(np.diff(p, axis=0)).sum(axis=0)
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _kpis(p):
+        # 与 _kpis_numpy 相同，每列只遍历一次
+        t, m = p.shape
+        peak = np.empty(m)
+        mean = np.empty(m)
+        ramp = np.empty(m)
+        for j in prange(m):
+            peak_j = p[0, j]
+            total = p[0, j]
+            ramp_j = 0.0
+            for i in range(1, t):
+                v = p[i, j]
+                if v > peak_j:
+                    peak_j = v
+                total += v
+                ramp_j += abs(v - p[i - 1, j])
+            peak[j] = peak_j
+            mean[j] = total / t
+            ramp[j] = ramp_j
+        return peak, mean, ramp
+else:
+    _kpis = _kpis_numpy
+
+def _as_data_dict(data):
+    """
+    将 dataclass 输入统一转换为字典 (tuple 字段转为 list)
+    """
+    if is_dataclass(data):
+        return {k: list(v) if isinstance(v, tuple) else v for k, v in asdict(data).items()}
+    return dict(data)
 
 class IESModel:
-    def __init__(self, data):
+    def __init__(self, data, cache_dir=None):
         """
         初始化综合能源系统模型
-        :param data: 包含负荷、PV曲线和设备参数的字典
+        :param data: 包含负荷、PV曲线和设备参数的字典，或同名字段的 dataclass (如 ies_app.IESInputs)
+        :param cache_dir: 求解结果缓存目录 (netCDF)，为 None 时不缓存；相同输入再次 solve() 时直接读取缓存
         """
+        data = _as_data_dict(data)
         self.data = data
+        self.cache_dir = cache_dir
+        # solve_rolling() 拼接后的总运行成本 (元)
+        self.rolling_objective = None
         self.hours = data.get('hours', 24)
         self.n = pypsa.Network()
         self.n.set_snapshots(range(self.hours))
         
-    def build_model(self, components=None):
+        # 预先将逐时曲线转换为以 snapshots 为索引的 float64 Series，避免 PyPSA 在每次 add 时重复转换
+        self._snap_idx = self.n.snapshots
+        self.ts = {
+            k: self._to_series(v)
+            for k, v in data.items()
+            if self._is_timeseries(v)
+        }
+
+    def _is_timeseries(self, v):
+        return isinstance(v, (list, tuple, np.ndarray)) and len(v) == self.hours
+
+    def _to_series(self, v):
+        return pd.Series(np.asarray(v, dtype=np.float64), index=self._snap_idx)
+        
+    def build_model(self, components=None, skip_trivial_cooling=False):
         """
-        构建模型拓扑
+        构建模型：先添加组件拓扑及静态参数，再写入逐时曲线
         :param components: 可选的组件列表，如果为 None，则根据 self.data 构建默认全量模型
+        :param skip_trivial_cooling: 冷负荷峰值低于 TRIVIAL_COOL_LOAD 时不建冷负荷及热泵制冷链路 (忽略冷负荷的近似)
         """
+        self._build_topology(components, skip_trivial_cooling)
+        self._load_timeseries()
+
+    def _has_load(self, key):
+        """逐时负荷存在且不全为零"""
+        return key in self.ts and bool(self.ts[key].to_numpy().any())
+
+    def _build_topology(self, components=None, skip_trivial_cooling=False):
+        """
+        添加母线、发电机、负载、链路和储能及其静态参数 (每个网络只运行一次)
+        全零的氢负荷不添加 Load (Load 为固定值，只进入母线平衡的右端项，不会减少约束数)；
+        需要缩小模型规模时使用 skip_trivial_cooling
+        :param components: 可选的组件列表，如果为 None，则添加所有支持的设备
+        :param skip_trivial_cooling: 同 build_model
+        """
+        # 各类组件先收集为 spec 列表，最后每类只调用一次 n.add 批量添加
         # 1. 添加母线 (Buses) - 默认存在
-        self.n.add("Bus", "electricity", carrier="AC")
-        self.n.add("Bus", "heat", carrier="heat")
-        self.n.add("Bus", "cooling", carrier="cooling")
-        self.n.add("Bus", "hydrogen", carrier="H2")
+        bus_specs = [
+            {'name': "electricity", 'carrier': "AC"},
+            {'name': "heat", 'carrier': "heat"},
+            {'name': "cooling", 'carrier': "cooling"},
+            {'name': "hydrogen", 'carrier': "H2"},
+        ]
 
         # 2. 添加默认发电机 (电网和PV通常是基础)
+        gen_specs = []
         if components is None or 'grid' in components:
-            self.n.add("Generator", "grid", 
-                      bus="electricity", 
-                      p_nom_extendable=True, 
-                      marginal_cost=self.data.get('grid_cost'))
+            gen_specs.append({'name': "grid",
+                              'bus': "electricity",
+                              'p_nom_extendable': True,
+                              'marginal_cost': 0 if 'grid_cost' in self.ts else self.data.get('grid_cost')})
         
         if components is None or 'pv' in components:
-            self.n.add("Generator", "pv", 
-                      bus="electricity", 
-                      p_nom=self.data.get('pv_p_nom', 100),
-                      p_max_pu=self.data['pv_pu'], 
-                      marginal_cost=self.data.get('pv_cost', 0.01))
+            gen_specs.append({'name': "pv",
+                              'bus': "electricity",
+                              'p_nom': self.data.get('pv_p_nom', 100),
+                              'marginal_cost': self.data.get('pv_cost', 0.01)})
 
         # 3. 根据组件列表添加 Link 和 Storage
         # 如果 components 为 None，则添加所有支持的设备
@@ -46,18 +204,25 @@ class IESModel:
         ]
 
         # 负载添加 (默认添加，或者根据是否有对应母线的设备动态添加)
-        self.n.add("Load", "elec_load", bus="electricity", p_set=self.data['elec_load'])
-        self.n.add("Load", "heat_load", bus="heat", p_set=self.data['heat_load'])
-        self.n.add("Load", "cool_load", bus="cooling", p_set=self.data['cool_load'])
-        if 'h2_load' in self.data:
-            self.n.add("Load", "h2_load", bus="hydrogen", p_set=self.data['h2_load'])
+        # 冷负荷可忽略时不建冷负荷与制冷链路，热泵只剩制热，也就不再需要模式二进制变量
+        with_cooling = not (skip_trivial_cooling and 'cool_load' in self.ts
+                            and self.ts['cool_load'].max() < TRIVIAL_COOL_LOAD)
+        load_specs = [
+            {'name': "elec_load", 'bus': "electricity"},
+            {'name': "heat_load", 'bus': "heat"},
+        ]
+        if with_cooling:
+            load_specs.append({'name': "cool_load", 'bus': "cooling"})
+        if self._has_load('h2_load'):
+            load_specs.append({'name': "h2_load", 'bus': "hydrogen"})
 
+        link_specs = []
         if 'electric_boiler' in all_devices:
-            self.n.add("Link", "electric_boiler", 
-                      bus0="electricity", 
-                      bus1="heat", 
-                      p_nom=self.data.get('boiler_p_nom', 20),
-                      efficiency=self.data.get('boiler_eff', 0.98))
+            link_specs.append({'name': "electric_boiler",
+                               'bus0': "electricity",
+                               'bus1': "heat",
+                               'p_nom': self.data.get('boiler_p_nom', 20),
+                               'efficiency': self.data.get('boiler_eff', 0.98)})
 
         # 热泵类型处理
         hp_types = {
@@ -68,90 +233,230 @@ class IESModel:
 
         for hp_key, (prefix, name) in hp_types.items():
             if hp_key in all_devices:
-                self.n.add("Link", f"{prefix}_heating", 
-                          bus0="electricity", 
-                          bus1="heat", 
-                          p_nom=self.data.get(f'{prefix}_p_nom', 40),
-                          efficiency=self.data.get(f'{prefix}_eff', 3.0))
-                self.n.add("Link", f"{prefix}_cooling", 
-                          bus0="electricity", 
-                          bus1="cooling", 
-                          p_nom=self.data.get(f'{prefix}_p_nom', 40),
-                          efficiency=self.data.get(f'{prefix}_eer', 3.5))
+                link_specs.append({'name': f"{prefix}_heating",
+                                   'bus0': "electricity",
+                                   'bus1': "heat",
+                                   'p_nom': self.data.get(f'{prefix}_p_nom', 40),
+                                   'efficiency': self.data.get(f'{prefix}_eff', 3.0)})
+                if with_cooling:
+                    link_specs.append({'name': f"{prefix}_cooling",
+                                       'bus0': "electricity",
+                                       'bus1': "cooling",
+                                       'p_nom': self.data.get(f'{prefix}_p_nom', 40),
+                                       'efficiency': self.data.get(f'{prefix}_eer', 3.5)})
 
         if 'electrolyzer' in all_devices:
-            self.n.add("Link", "electrolyzer", 
-                      bus0="electricity", 
-                      bus1="hydrogen", 
-                      p_nom=self.data.get('ely_p_nom', 50),
-                      efficiency=self.data.get('ely_eff', 0.75))
+            link_specs.append({'name': "electrolyzer",
+                               'bus0': "electricity",
+                               'bus1': "hydrogen",
+                               'p_nom': self.data.get('ely_p_nom', 50),
+                               'efficiency': self.data.get('ely_eff', 0.75)})
 
         if 'fuel_cell' in all_devices:
-            self.n.add("Link", "fuel_cell", 
-                      bus0="hydrogen", 
-                      bus1="electricity", 
-                      bus2="heat",
-                      p_nom=self.data.get('fc_p_nom', 50),
-                      efficiency=self.data.get('fc_eff_elec', 0.45),
-                      efficiency2=self.data.get('fc_eff_heat', 0.40))
+            link_specs.append({'name': "fuel_cell",
+                               'bus0': "hydrogen",
+                               'bus1': "electricity",
+                               'bus2': "heat",
+                               'p_nom': self.data.get('fc_p_nom', 50),
+                               'efficiency': self.data.get('fc_eff_elec', 0.45),
+                               'efficiency2': self.data.get('fc_eff_heat', 0.40)})
 
+        storage_specs = []
         if 'battery' in all_devices:
-            self.n.add("StorageUnit", "battery",
-                      bus="electricity",
-                      p_nom=self.data.get('bat_p_nom', 30),
-                      max_hours=self.data.get('bat_hours', 4),
-                      efficiency_store=self.data.get('bat_eff_store', 0.9),
-                      efficiency_dispatch=self.data.get('bat_eff_dispatch', 0.9),
-                      cyclic_state_of_charge=True,
-                      marginal_cost=0.01) # 降低储能成本以鼓励使用
+            storage_specs.append({'name': "battery",
+                                  'bus': "electricity",
+                                  'p_nom': self.data.get('bat_p_nom', 30),
+                                  'max_hours': self.data.get('bat_hours', 4),
+                                  'efficiency_store': self.data.get('bat_eff_store', 0.9),
+                                  'efficiency_dispatch': self.data.get('bat_eff_dispatch', 0.9),
+                                  'cyclic_state_of_charge': True,
+                                  'marginal_cost': 0.01}) # 降低储能成本以鼓励使用
 
         if 'h2_storage' in all_devices:
-            self.n.add("StorageUnit", "h2_storage",
-                      bus="hydrogen",
-                      p_nom=self.data.get('h2s_p_nom', 100),
-                      max_hours=self.data.get('h2s_hours', 20),
-                      efficiency_store=0.98,
-                      efficiency_dispatch=0.98,
-                      cyclic_state_of_charge=True,
-                      marginal_cost=0.005)
-
-    def solve(self):
+            storage_specs.append({'name': "h2_storage",
+                                  'bus': "hydrogen",
+                                  'p_nom': self.data.get('h2s_p_nom', 100),
+                                  'max_hours': self.data.get('h2s_hours', 20),
+                                  'efficiency_store': 0.98,
+                                  'efficiency_dispatch': 0.98,
+                                  'cyclic_state_of_charge': True,
+                                  'marginal_cost': 0.005})
+
+        for class_name, specs in [("Bus", bus_specs), ("Generator", gen_specs), ("Load", load_specs),
+                                  ("Link", link_specs), ("StorageUnit", storage_specs)]:
+            self._add_batch(class_name, specs)
+
+    def _add_batch(self, class_name, specs):
+        """
+        将同类组件一次性批量添加 (只触发一次 concat)，spec 中缺失或为 None 的属性以 PyPSA 默认值补齐
+        :param class_name: 组件类型，如 "Link"
+        :param specs: [{'name': 组件名, 属性: 值, ...}, ...]
+        """
+        if not specs:
+            return
+        defaults = self.n.components[class_name].defaults['default']
+        keys = list(dict.fromkeys(k for spec in specs for k in spec if k != 'name'))
+        fill = {k: MULTIPORT_DEFAULTS.get(k, defaults.get(k)) for k in keys}
+        self.n.add(class_name, [spec['name'] for spec in specs],
+                   **{k: [fill[k] if spec.get(k) is None else spec[k] for spec in specs] for k in keys})
+
+    def _load_timeseries(self, keys=None):
+        """
+        将逐时曲线写入网络的时变属性 (负荷 p_set、PV p_max_pu、电网电价 marginal_cost)
+        :param keys: 需要写入的参数名，为 None 时写入全部
+        """
+        for key in (TIMESERIES_ATTRS if keys is None else keys):
+            component, name, attr = TIMESERIES_ATTRS[key]
+            if key in self.ts and name in getattr(self.n, component).index:
+                getattr(self.n, f"{component}_t")[attr][name] = self.ts[key]
+
+    def reconfigure(self, new_data):
+        """
+        在已构建的网络上就地修改参数，只写入发生变化的项，无需重新 build_model
+        适用于参数扫描 / 容量寻优等需要反复求解同一拓扑的场景
+        :param new_data: 需要更新的参数 (字典或 dataclass)，键名同 data
+        :return: 实际发生变化的参数名列表 (均已写入网络)
+        :raises ValueError: hours 变化、逐时参数长度不符，或构建时省略的负荷变为非零
+        """
+        new_data = _as_data_dict(new_data)
+        if new_data.get('hours', self.hours) != self.hours:
+            raise ValueError("hours 发生变化，请重新创建 IESModel")
+
+        changed = [k for k, v in new_data.items() if not np.array_equal(np.asarray(self.data.get(k), dtype=object), np.asarray(v, dtype=object))]
+        for key in changed:
+            value = new_data[key]
+            if key in TIMESERIES_ATTRS and not (self._is_timeseries(value) or np.ndim(value) == 0):
+                raise ValueError(f"{key} 必须是长度为 {self.hours} 的逐时曲线或标量")
+            # 构建时被省略的负荷 (如全零氢负荷) 变为非零会改变拓扑，无法就地修改
+            if key in TIMESERIES_ATTRS and TIMESERIES_ATTRS[key][0] == 'loads':
+                if TIMESERIES_ATTRS[key][1] not in self.n.loads.index and np.any(np.asarray(new_data[key]) != 0):
+                    raise ValueError(f"{key} 在当前网络中未建模，请重新 build_model")
+        for key in changed:
+            value = new_data[key]
+            self.data[key] = value
+            if key in TIMESERIES_ATTRS:
+                if self._is_timeseries(value):
+                    self.ts[key] = self._to_series(value)
+                    self._load_timeseries([key])
+                else:
+                    # 逐时曲线改为标量：删去时变列，改写静态属性
+                    self.ts.pop(key, None)
+                    component, name, attr = TIMESERIES_ATTRS[key]
+                    if name in getattr(self.n, component).index:
+                        dynamic = getattr(self.n, f"{component}_t")
+                        dynamic[attr] = dynamic[attr].drop(columns=[name], errors='ignore')
+                        getattr(self.n, component).at[name, attr] = float(value)
+            for component, name, attr in STATIC_ATTRS.get(key, []):
+                df = getattr(self.n, component)
+                if name in df.index:
+                    df.at[name, attr] = value
+        return changed
+
+    def solve(self, solver_name=None, solver_options=None, warm_start=False, tolerances=None):
         """
         运行优化求解，并添加自定义约束
+        :param solver_name: 指定求解器 (如 'highs')，为 None 时依次尝试 gurobi / copt / glpk
+        :param solver_options: 传递给求解器的参数字典，优先于 tolerances 生成的同名参数
+        :param warm_start: 是否先求解 LP 松弛，为热泵模式变量提供 MIP 初始解 (仅 highs / gurobi)
+        :param tolerances: 通用容差 {'mip_gap': ..., 'feasibility': ...}，按求解器映射为对应参数名；
+                           为 None 时使用 DEFAULT_TOLERANCES (放宽的探索性容差)，严格求解可传入 {} 或更小的值
         """
-        def extra_functionality(n, snapshots):
+        if tolerances is None:
+            tolerances = DEFAULT_TOLERANCES
+
+        def options_for(solver):
+            key_map = TOLERANCE_KEYS.get(solver, {})
+            opts = {key_map[k]: v for k, v in tolerances.items() if k in key_map}
+            opts.update(solver_options or {})
+            return opts
+
+        # 指定支持 MILP 的求解器
+        solvers = [solver_name] if solver_name is not None else ['gurobi', 'copt', 'glpk']
+        # 缓存键包含各候选求解器的实际参数，不同容差 / 初始解设置的结果互不复用
+        cache_path = self._cache_path({
+            'solvers': [[solver, options_for(solver)] for solver in solvers],
+            'warm_start': warm_start,
+        })
+        if cache_path is not None and os.path.exists(cache_path):
+            print(f"Loading cached solution: {cache_path}")
+            network = self.n
+            self.load(cache_path)
+            if self.n.is_solved:
+                return True
+            # 未求解的缓存文件无效，删除后重新求解
+            print(f"Cached network is not solved, discarding: {cache_path}")
+            self.n = network
+            os.remove(cache_path)
+
+        def extra_functionality(n, snapshots, solver=None, relax=False, mip_start=None, mip_start_fn=None):
             # 获取 Link 的功率变量
             if "Link-p" in n.model.variables:
                 p_links = n.model.variables["Link-p"]
             else:
                 return
 
-            # 为每种热泵添加互斥约束
-            for prefix in ['ashp', 'gshp_shallow', 'gshp_deep']:
-                heating_name = f"{prefix}_heating"
-                cooling_name = f"{prefix}_cooling"
-                
-                if heating_name in n.links.index and cooling_name in n.links.index:
-                    p0_heat = p_links.sel(name=heating_name)
-                    p0_cool = p_links.sel(name=cooling_name)
-                    p_nom = n.links.at[heating_name, "p_nom"]
-                    
-                    # 1. 容量共享约束
-                    n.model.add_constraints(p0_heat + p0_cool <= p_nom, name=f"{prefix}_capacity_sharing")
-
-                    # 2. 互斥约束
-                    n.model.add_variables(coords=[snapshots], name=f"{prefix}_mode", binary=True)
-                    z = n.model.variables[f"{prefix}_mode"]
-                    n.model.add_constraints(p0_heat - z * p_nom <= 0, name=f"{prefix}_heating_exclusion")
-                    n.model.add_constraints(p0_cool - (1 - z) * p_nom <= 0, name=f"{prefix}_cooling_exclusion")
+            # 所有热泵沿 hp 维度堆叠，每类约束只调用一次 add_constraints
+            prefixes = [prefix for prefix in ['ashp', 'gshp_shallow', 'gshp_deep']
+                        if f"{prefix}_heating" in n.links.index and f"{prefix}_cooling" in n.links.index]
+            start_cols = []
+            if prefixes:
+                hp = pd.Index(prefixes, name="hp")
+                heating_names = [f"{prefix}_heating" for prefix in prefixes]
+                cooling_names = [f"{prefix}_cooling" for prefix in prefixes]
+                p0_heat = p_links.sel(name=heating_names).rename(name="hp").assign_coords(hp=hp)
+                p0_cool = p_links.sel(name=cooling_names).rename(name="hp").assign_coords(hp=hp)
+                # 额定功率预先展开为 hp × snapshot 的 DataArray，约束右端项无需再由 linopy 广播
+                p_nom = xr.DataArray(
+                    np.repeat(n.links.loc[heating_names, "p_nom"].to_numpy(dtype=np.float64)[:, None], len(snapshots), axis=1),
+                    coords=[hp, snapshots])
+
+                # 1. 容量共享约束
+                n.model.add_constraints(p0_heat + p0_cool <= p_nom, name="hp_capacity_sharing")
+
+                # 2. 互斥约束 (z=1 允许制热，z=0 允许制冷)，relax=True 时求解其 LP 松弛
+                if relax:
+                    z = n.model.add_variables(lower=0, upper=1, coords=[hp, snapshots], name="hp_mode")
+                else:
+                    z = n.model.add_variables(coords=[hp, snapshots], name="hp_mode", binary=True)
+                if mip_start is not None:
+                    start_cols = [(z.labels.sel(hp=prefix).values, mip_start[prefix])
+                                  for prefix in prefixes if prefix in mip_start]
+                if solver == 'gurobi' and not relax:
+                    # Gurobi 原生支持指示约束，避免 Big-M 削弱 LP 松弛
+                    n.model.add_indicator_constraints(z, 0, p0_heat, "<=", 0, name="hp_heating_exclusion")
+                    n.model.add_indicator_constraints(z, 1, p0_cool, "<=", 0, name="hp_cooling_exclusion")
+                else:
+                    n.model.add_constraints(p0_heat - z * p_nom <= 0, name="hp_heating_exclusion")
+                    n.model.add_constraints(p0_cool - (1 - z) * p_nom <= 0, name="hp_cooling_exclusion")
+
+            if mip_start_fn is not None:
+                self._write_mip_start(mip_start_fn, solver, start_cols)
 
         success = False
-        # 指定支持 MILP 的求解器
-        for solver in ['gurobi', 'copt', 'glpk']:
+        # linopy 模型只在约束形式变化时重建 (gurobi 使用指示约束，其余求解器使用 Big-M)，
+        # 求解失败切换求解器时直接复用已建好的模型
+        model_form = None
+        for solver in solvers:
+            mip_start_fn = None
             try:
                 print(f"Attempting optimization with solver: {solver}")
-                # 使用 extra_functionality 传递自定义约束
-                results = self.n.optimize(solver_name=solver, extra_functionality=extra_functionality)
+                kwargs = {}
+                form = 'indicator' if solver == 'gurobi' else 'big_m'
+                if warm_start and solver in MIP_START_SUFFIX:
+                    mip_start = self._relaxed_mode_start(solver, options_for(solver), extra_functionality)
+                    # 松弛求解替换了 n.model，初始解文件也需在新建模型时按其变量编号写出
+                    model_form = None
+                    if mip_start:
+                        fd, mip_start_fn = tempfile.mkstemp(suffix=MIP_START_SUFFIX[solver])
+                        os.close(fd)
+                        kwargs = {'mip_start': mip_start, 'mip_start_fn': mip_start_fn}
+                if model_form != form:
+                    self.n.optimize.create_model()
+                    # 使用 extra_functionality 添加自定义约束
+                    extra_functionality(self.n, self.n.snapshots, solver=solver, **kwargs)
+                    model_form = form
+                results = self.n.optimize.solve_model(solver_name=solver, solver_options=options_for(solver),
+                                                      **({'warmstart_fn': mip_start_fn} if mip_start_fn else {}))
                 status = results[0] if isinstance(results, tuple) else results
                 if status == 'ok':
                     print(f"Optimization successful with {solver}")
@@ -160,16 +465,165 @@ class IESModel:
             except Exception as e:
                 print(f"Solver {solver} failed: {e}")
                 continue
+            finally:
+                if mip_start_fn is not None:
+                    os.remove(mip_start_fn)
         
         if not success:
             try:
                 print("Trying default solver...")
-                self.n.optimize(extra_functionality=extra_functionality)
-                success = True
+                if model_form != 'big_m':
+                    self.n.optimize.create_model()
+                    extra_functionality(self.n, self.n.snapshots)
+                status, condition = self.n.optimize.solve_model()
+                success = status == 'ok'
+                if not success:
+                    print(f"Default solver failed: {status} ({condition})")
             except Exception as e:
                 print(f"All optimization attempts failed: {e}")
+        # 只缓存真正求解成功的网络
+        if success and cache_path is not None and self.n.is_solved:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.save(cache_path)
         return success
 
+    def solve_rolling(self, window=168, overlap=24, solver_name=None, solver_options=None, tolerances=None):
+        """
+        滚动时域求解：将全时段拆分为若干个 window 小时的子 MILP 依次求解，适用于全年 (8760h) 等长时段
+        每个窗口只保留前 window - overlap 小时的结果，末段 overlap 小时作为前瞻；
+        下一窗口以上一窗口保留段末尾的储能 SOC 作为初始值 (代替 cyclic_state_of_charge)
+        :param window: 每个子问题的时长 (小时)
+        :param overlap: 相邻窗口的重叠时长 (小时)，须小于 window
+        :param solver_name / solver_options / tolerances: 同 solve()
+        :return: 是否全部窗口求解成功；结果拼接后写回 self.n，总运行成本存于 self.rolling_objective
+                 (self.n 本身未整体求解，其 n.objective 不代表滚动结果)
+        """
+        if not 0 <= overlap < window:
+            raise ValueError("overlap 必须满足 0 <= overlap < window")
+        self.rolling_objective = None
+        if self.hours <= window:
+            ok = self.solve(solver_name=solver_name, solver_options=solver_options, tolerances=tolerances)
+            self.rolling_objective = self.n.objective if ok else None
+            return ok
+
+        # 各窗口子问题的初始 SOC 不在 self.data 中，不能按输入数据缓存
+        full, cache_dir = self.n, self.cache_dir
+        self.cache_dir = None
+        step = window - overlap
+        soc_initial = full.storage_units.state_of_charge_initial.copy()
+        # links_t.p2 只在存在多端口 Link (燃料电池) 时才有，只拼接网络中实际存在的结果属性
+        parts = {(c, attr): [] for c, attrs in ROLLING_RESULT_ATTRS.items() for attr in attrs
+                 if attr in getattr(full, f"{c}_t")}
+        try:
+            for start in range(0, self.hours, step):
+                end = min(start + window, self.hours)
+                keep = full.snapshots[start:end] if end == self.hours else full.snapshots[start:start + step]
+                sub = full.copy(snapshots=full.snapshots[start:end])
+                sub.storage_units['cyclic_state_of_charge'] = False
+                sub.storage_units['state_of_charge_initial'] = soc_initial
+
+                print(f"Rolling window {start}-{end}")
+                self.n = sub
+                if not self.solve(solver_name=solver_name, solver_options=solver_options, tolerances=tolerances):
+                    return False
+
+                for (c, attr), frames in parts.items():
+                    frames.append(getattr(sub, f"{c}_t")[attr].loc[keep])
+                soc_initial = sub.storage_units_t.state_of_charge.loc[keep[-1]].reindex(soc_initial.index, fill_value=0.0)
+                if end == self.hours:
+                    break
+        finally:
+            self.n, self.cache_dir = full, cache_dir
+
+        for (c, attr), frames in parts.items():
+            getattr(full, f"{c}_t")[attr] = pd.concat(frames)
+        # 拼接后的总运行成本 (仅统计各窗口保留段，避免重叠段重复计入)
+        self.rolling_objective = sum(
+            (full.get_switchable_as_dense(component, 'marginal_cost') * getattr(full, f"{c}_t")[attr]).sum().sum()
+            for component, c, attr in [('Generator', 'generators', 'p'), ('Link', 'links', 'p0'),
+                                       ('StorageUnit', 'storage_units', 'p_dispatch')]
+        )
+        return True
+
+    def save(self, path):
+        """
+        将网络 (含求解结果) 导出为 netCDF 文件
+        """
+        self.n.export_to_netcdf(path)
+
+    def load(self, path):
+        """
+        从 netCDF 文件读取之前保存的网络 (含求解结果)
+        """
+        self.n = pypsa.Network(path)
+
+    def cache_key(self, solve_settings=None):
+        """
+        由输入数据、已构建的组件列表和求解设置计算缓存键 (blake2b 摘要前 16 位)
+        :param solve_settings: solve() 的实际求解器及参数，不同设置得到不同的键
+        """
+        payload = {
+            'data': self.data,
+            'components': {c: list(getattr(self.n, c).index) for c in ('generators', 'loads', 'links', 'storage_units')},
+            'solve': solve_settings,
+        }
+        text = json.dumps(payload, sort_keys=True, default=lambda v: np.asarray(v).tolist())
+        return hashlib.blake2b(text.encode()).hexdigest()[:16]
+
+    def _cache_path(self, solve_settings=None):
+        if self.cache_dir is None:
+            return None
+        return os.path.join(self.cache_dir, f"{self.cache_key(solve_settings)}.nc")
+
+    def _relaxed_mode_start(self, solver, solver_options, extra_functionality):
+        """
+        求解模式变量取连续值的 LP 松弛，按制热/制冷功率大小给出热泵模式变量的初始整数解
+        :return: {热泵前缀: 0/1 数组}，无热泵或松弛求解失败时返回 None
+        """
+        status = self.n.optimize(solver_name=solver, solver_options=solver_options,
+                                 extra_functionality=functools.partial(extra_functionality, solver=solver, relax=True))
+        status = status[0] if isinstance(status, tuple) else status
+        if status != 'ok':
+            return None
+        p0 = self.n.links_t.p0
+        return {
+            prefix: (p0[f"{prefix}_heating"] > p0[f"{prefix}_cooling"]).to_numpy().astype(int)
+            for prefix in ['ashp', 'gshp_shallow', 'gshp_deep']
+            if f"{prefix}_heating" in p0.columns and f"{prefix}_cooling" in p0.columns
+        }
+
+    @staticmethod
+    def _write_mip_start(path, solver, start_cols):
+        """
+        写出 MIP 初始解文件 (linopy 的 LP 文件中变量名为 x{label})
+        highs 使用稀疏格式 .sol (仅给定整数变量，其余由 HiGHS 求 LP 补全)，gurobi 使用 .mst
+        """
+        entries = [(int(label), int(value)) for labels, values in start_cols for label, value in zip(labels, values)]
+        with open(path, 'w') as f:
+            if solver == 'highs':
+                f.write("Model status\nNone\n\n# Primal solution values\nFeasible\nObjective 0\n")
+                f.write(f"# Columns -{len(entries)}\n")
+                for label, value in entries:
+                    f.write(f"x{label} {value} {label}\n")
+            else:
+                f.write("# MIP start\n")
+                for label, value in entries:
+                    f.write(f"x{label} {value}\n")
+
+    def link_kpis(self):
+        """
+        统计各 Link 的输入功率指标
+        :return: DataFrame，索引为 Link 名，列为 max_p (峰值)、mean_p (均值)、ramp (爬坡量) 和 utilisation (平均负载率)
+        """
+        p0 = self.n.links_t.p0
+        if p0.empty:
+            return pd.DataFrame(columns=['max_p', 'mean_p', 'ramp', 'utilisation'])
+        peak, mean, ramp = _kpis(np.ascontiguousarray(p0.to_numpy(dtype=np.float64)))
+        p_nom = self.n.links.loc[p0.columns, 'p_nom'].to_numpy(dtype=np.float64)
+        utilisation = np.divide(mean, p_nom, out=np.zeros_like(mean), where=p_nom > 0)
+        return pd.DataFrame({'max_p': peak, 'mean_p': mean, 'ramp': ramp, 'utilisation': utilisation},
+                            index=p0.columns)
+
     def get_all_results(self):
         """
         汇总所有设备的运行结果
@@ -189,7 +643,8 @@ class IESModel:
             self.n.links_t.p0.add_suffix('_input'),
             self.n.links_t.p1.add_suffix('_output')
         ], axis=1)
-        if not self.n.links_t.p2.empty:
+        # 只有存在多端口 Link (燃料电池) 时网络才有 p2
+        if 'p2' in self.n.links_t and not self.n.links_t.p2.empty:
             links_res = pd.concat([links_res, self.n.links_t.p2.add_suffix('_output2')], axis=1)
         results['Links'] = links_res
         
@@ -210,97 +665,101 @@ class IESModel:
         plt.rcParams['xtick.color'] = 'black'
         plt.rcParams['ytick.color'] = 'black'
         
-        fig = plt.figure(figsize=(15, 18))
+        fig, axes = plt.subplots(5, 1, sharex=True, figsize=(15, 18))
+        
+        # 结果表及其列名集合只取一次，后续子图用集合判断列是否存在
+        gen_p = self.n.generators_t.p
+        # 没有多端口 Link (燃料电池) 时网络不存在 p2，以空表代替
+        p0, p1 = self.n.links_t.p0, self.n.links_t.p1
+        p2 = self.n.links_t.p2 if 'p2' in self.n.links_t else pd.DataFrame(index=self.n.snapshots)
+        cols_p0, cols_p1, cols_p2 = set(p0.columns), set(p1.columns), set(p2.columns)
+        sto_p, soc = self.n.storage_units_t.p, self.n.storage_units_t.state_of_charge
+        cols_sto = set(sto_p.columns)
+        load_p_set = self.n.loads_t.p_set
+        cols_load = set(load_p_set.columns)
+        snapshots = self.n.snapshots.to_numpy()
         
         # 子图 1: 电力平衡
-        plt.subplot(5, 1, 1)
-        if not self.n.generators_t.p.empty:
-            self.n.generators_t.p.clip(lower=0).plot.area(ax=plt.gca(), alpha=0.7)
-        if not self.n.storage_units_t.p.empty and 'battery' in self.n.storage_units_t.p.columns:
-            self.n.storage_units_t.p['battery'].plot(ax=plt.gca(), color='orange', label='Battery Dispatch', linewidth=2)
-        if not self.n.links_t.p1.empty and 'fuel_cell' in self.n.links_t.p1.columns:
-            self.n.links_t.p1['fuel_cell'].plot(ax=plt.gca(), color='brown', label='Fuel Cell Output (Elec)', linewidth=2)
+        ax = axes[0]
+        if not gen_p.empty:
+            gen_p.clip(lower=0).plot.area(ax=ax, alpha=0.7)
+        if 'battery' in cols_sto:
+            sto_p['battery'].plot(ax=ax, color='orange', label='Battery Dispatch', linewidth=2)
+        if 'fuel_cell' in cols_p1:
+            p1['fuel_cell'].plot(ax=ax, color='brown', label='Fuel Cell Output (Elec)', linewidth=2)
         
-        total_elec_cons = self.n.loads_t.p_set['elec_load'].copy()
-        if not self.n.links_t.p0.empty:
-            # 包含 电解槽、电锅炉、各类热泵 的耗电
-            hp_cols = []
-            for prefix in ['ashp', 'gshp_shallow', 'gshp_deep']:
-                hp_cols.extend([f"{prefix}_heating", f"{prefix}_cooling"])
-            
-            cols = [c for c in (['electrolyzer', 'electric_boiler'] + hp_cols) if c in self.n.links_t.p0.columns]
-            total_elec_cons += self.n.links_t.p0[cols].sum(axis=1)
+        # 包含 电解槽、电锅炉、各类热泵 的耗电 (一次性按列求和)
+        hp_cols = [f"{prefix}_{mode}" for prefix in ['ashp', 'gshp_shallow', 'gshp_deep'] for mode in ['heating', 'cooling']]
+        cols_present = [c for c in ['electrolyzer', 'electric_boiler'] + hp_cols if c in cols_p0]
+        total_elec_cons = load_p_set['elec_load'].to_numpy() + p0[cols_present].to_numpy().sum(axis=1)
         
-        plt.plot(total_elec_cons, 'r-', label='Total Elec Demand', linewidth=1)
-        plt.title("Electricity Balance")
-        plt.ylabel("Power [kW]")
-        plt.legend(loc='upper right')
+        ax.plot(snapshots, total_elec_cons, 'r-', label='Total Elec Demand', linewidth=1)
+        ax.set_title("Electricity Balance")
+        ax.set_ylabel("Power [kW]")
+        ax.legend(loc='upper right')
 
         # 子图 2: 热力平衡
-        plt.subplot(5, 1, 2)
-        if not self.n.links_t.p1.empty:
-            # 电锅炉和各类热泵制热
-            hp_heating_cols = [f"{prefix}_heating" for prefix in ['ashp', 'gshp_shallow', 'gshp_deep']]
-            # 增加对 p1 实际内容的检查
-            cols = [c for c in (['electric_boiler'] + hp_heating_cols) if c in self.n.links_t.p1.columns]
-            if cols:
-                # 获取 p1 数据并过滤极微小负值
-                heat_output_p1 = self.n.links_t.p1[cols].clip(lower=0)
-                if not heat_output_p1.empty and heat_output_p1.sum().sum() > 0.1:
-                    heat_output_p1.plot.area(ax=plt.gca(), alpha=0.7)
+        ax = axes[1]
+        # 电锅炉和各类热泵制热
+        hp_heating_cols = [f"{prefix}_heating" for prefix in ['ashp', 'gshp_shallow', 'gshp_deep']]
+        cols = [c for c in (['electric_boiler'] + hp_heating_cols) if c in cols_p1]
+        if cols:
+            # 获取 p1 数据并过滤极微小负值
+            heat_output_p1 = p1[cols].clip(lower=0)
+            if not heat_output_p1.empty and heat_output_p1.sum().sum() > 0.1:
+                heat_output_p1.plot.area(ax=ax, alpha=0.7)
         
         # 增加燃料电池产热 (p2)
-        if not self.n.links_t.p2.empty and 'fuel_cell' in self.n.links_t.p2.columns:
-            fc_heat = self.n.links_t.p2['fuel_cell'].clip(lower=0)
+        if 'fuel_cell' in cols_p2:
+            fc_heat = p2['fuel_cell'].clip(lower=0)
             if fc_heat.sum() > 0.1:
-                fc_heat.plot(ax=plt.gca(), color='magenta', label='Fuel Cell Output (Heat)', linewidth=2)
+                fc_heat.plot(ax=ax, color='magenta', label='Fuel Cell Output (Heat)', linewidth=2)
 
         # 始终绘制负荷线
-        heat_load = self.n.loads_t.p['heat_load'] if 'heat_load' in self.n.loads_t.p.columns else self.data['heat_load']
-        plt.plot(heat_load, 'k--', label='Heat Load', linewidth=2)
-        plt.title("Heat Balance")
-        plt.ylabel("Power [kW]")
-        plt.legend(loc='upper right')
+        heat_load = self.n.loads_t.p['heat_load'] if 'heat_load' in self.n.loads_t.p.columns else self.ts['heat_load']
+        ax.plot(snapshots, heat_load.to_numpy(), 'k--', label='Heat Load', linewidth=2)
+        ax.set_title("Heat Balance")
+        ax.set_ylabel("Power [kW]")
+        ax.legend(loc='upper right')
 
         # 子图 3: 冷却平衡
-        plt.subplot(5, 1, 3)
+        ax = axes[2]
         hp_cooling_cols = [f"{prefix}_cooling" for prefix in ['ashp', 'gshp_shallow', 'gshp_deep']]
-        cols = [c for c in hp_cooling_cols if c in self.n.links_t.p1.columns]
-        if not self.n.links_t.p1.empty and cols:
-            self.n.links_t.p1[cols].clip(lower=0).plot.area(ax=plt.gca(), alpha=0.7, label='HP Cooling Output')
-        plt.plot(self.n.loads_t.p_set['cool_load'], 'k--', label='Cooling Load', linewidth=2)
-        plt.title("Cooling Balance")
-        plt.ylabel("Power [kW]")
-        plt.legend(loc='upper right')
+        cols = [c for c in hp_cooling_cols if c in cols_p1]
+        if cols:
+            p1[cols].clip(lower=0).plot.area(ax=ax, alpha=0.7, label='HP Cooling Output')
+        if 'cool_load' in cols_load:
+            ax.plot(snapshots, load_p_set['cool_load'].to_numpy(), 'k--', label='Cooling Load', linewidth=2)
+        ax.set_title("Cooling Balance")
+        ax.set_ylabel("Power [kW]")
+        ax.legend(loc='upper right')
 
         # 子图 4: 氢能平衡
-        plt.subplot(5, 1, 4)
-        if not self.n.links_t.p1.empty and 'electrolyzer' in self.n.links_t.p1.columns:
-            self.n.links_t.p1[['electrolyzer']].clip(lower=0).plot.area(ax=plt.gca(), alpha=0.7, color='lightgreen', label='Electrolyzer Output (H2)')
-        if not self.n.storage_units_t.p.empty and 'h2_storage' in self.n.storage_units_t.p.columns:
-            self.n.storage_units_t.p['h2_storage'].plot(ax=plt.gca(), color='blue', label='H2 Storage Dispatch', linewidth=2)
+        ax = axes[3]
+        if 'electrolyzer' in cols_p1:
+            p1[['electrolyzer']].clip(lower=0).plot.area(ax=ax, alpha=0.7, color='lightgreen', label='Electrolyzer Output (H2)')
+        if 'h2_storage' in cols_sto:
+            sto_p['h2_storage'].plot(ax=ax, color='blue', label='H2 Storage Dispatch', linewidth=2)
         
-        h2_cons = pd.Series(0, index=self.n.snapshots)
-        if 'h2_load' in self.n.loads_t.p_set:
-            h2_cons += self.n.loads_t.p_set['h2_load']
-        if not self.n.links_t.p0.empty and 'fuel_cell' in self.n.links_t.p0.columns:
-            h2_cons += self.n.links_t.p0['fuel_cell']
+        h2_load_cols = [c for c in ['h2_load'] if c in cols_load]
+        fc_cols = [c for c in ['fuel_cell'] if c in cols_p0]
+        h2_cons = load_p_set[h2_load_cols].to_numpy().sum(axis=1) + p0[fc_cols].to_numpy().sum(axis=1)
         
-        plt.plot(h2_cons, 'k--', label='H2 Demand (FC + Load)', linewidth=2)
-        plt.title("Hydrogen Balance")
-        plt.ylabel("Power [kW_h2]")
-        plt.legend(loc='upper right')
+        ax.plot(snapshots, h2_cons, 'k--', label='H2 Demand (FC + Load)', linewidth=2)
+        ax.set_title("Hydrogen Balance")
+        ax.set_ylabel("Power [kW_h2]")
+        ax.legend(loc='upper right')
 
         # 子图 5: 储能状态 (SOC)
-        plt.subplot(5, 1, 5)
-        if not self.n.storage_units_t.state_of_charge.empty:
-            self.n.storage_units_t.state_of_charge.plot(ax=plt.gca(), linewidth=2)
-        plt.title("Storage State of Charge (SOC)")
-        plt.ylabel("Energy [kWh]")
-        plt.legend(loc='upper right')
-
-        plt.tight_layout()
-        plt.savefig(save_path)
+        ax = axes[4]
+        if not soc.empty:
+            soc.plot(ax=ax, linewidth=2)
+        ax.set_title("Storage State of Charge (SOC)")
+        ax.set_ylabel("Energy [kWh]")
+        ax.legend(loc='upper right')
+
+        fig.tight_layout()
+        fig.savefig(save_path)
         print(f"Results saved to '{save_path}'")
         if show:
             plt.show()
@@ -308,7 +767,6 @@ class IESModel:
 
 # --- 外部输入数据准备 ---
 hours = 24
-np.random.seed(42)
 
 input_data = {
     'hours': hours,
@@ -425,9 +883,8 @@ if __name__ == "__main__":
             total_cost = model.n.objective
             print(f"\nTotal Operation Cost: {total_cost:.2f} CNY")
             print("\nDevice Capacities and Utilization:")
-            for link in model.n.links.index:
-                if not model.n.links_t.p0.empty and link in model.n.links_t.p0.columns:
-                    max_p = model.n.links_t.p0[link].max()
-                    print(f" - {link}: Max Input Power = {max_p:.2f} kW")
+            for link, kpi in model.link_kpis().iterrows():
+                print(f" - {link}: Max Input Power = {kpi['max_p']:.2f} kW, "
+                      f"Utilization = {kpi['utilisation']:.1%}, Ramp = {kpi['ramp']:.2f} kW")
         except Exception as e:
             print(f"\nCould not calculate metrics: {e}")